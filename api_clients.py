@@ -0,0 +1,90 @@
+"""
+Shared HTTP clients for the OpenAI and Supabase SDKs.
+
+All scripts talk to the same two services, so they share one keep-alive
+connection pool instead of each SDK opening (and TLS-handshaking) its own.
+OpenAI calls also share one retry policy (openai_retry).
+"""
+import sys
+
+import httpx
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+try:
+    import h2  # noqa: F401
+    HAS_H2 = True
+except ImportError:
+    HAS_H2 = False
+
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50)
+HTTP_TIMEOUT = 30.0
+# Async clients also carry OpenAI vision calls, which can take minutes to
+# respond; keep the SDK's own 600 s read timeout so they aren't cut off
+# (and retried) mid-generation
+ASYNC_HTTP_TIMEOUT = httpx.Timeout(HTTP_TIMEOUT, read=600.0)
+# Retries on connection errors only (failed connects/handshakes)
+HTTP_CONNECT_RETRIES = 2
+
+# Attempts per OpenAI call (first try + retries) on 429s, 5xx and connection errors
+OPENAI_MAX_ATTEMPTS = 5
+OPENAI_MAX_BACKOFF = 30.0
+
+_http_client: httpx.Client | None = None
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Return the process-wide sync HTTP client, creating it on first use.
+    httpx.Client is thread-safe, so it can be shared across worker threads.
+    """
+    global _http_client
+    if _http_client is None:
+        transport = httpx.HTTPTransport(
+            http2=HAS_H2, limits=HTTP_LIMITS, retries=HTTP_CONNECT_RETRIES
+        )
+        _http_client = httpx.Client(transport=transport, timeout=HTTP_TIMEOUT)
+    return _http_client
+
+
+def make_async_http_client() -> httpx.AsyncClient:
+    """
+    Create a new async HTTP client with the same pool settings.
+
+    Async clients are bound to the event loop they are used on, so create one
+    per asyncio.run() and close it when done.
+    """
+    transport = httpx.AsyncHTTPTransport(
+        http2=HAS_H2, limits=HTTP_LIMITS, retries=HTTP_CONNECT_RETRIES
+    )
+    return httpx.AsyncClient(transport=transport, timeout=ASYNC_HTTP_TIMEOUT)
+
+
+def _log_openai_retry(retry_state) -> None:
+    """
+    Report a retried OpenAI call on stderr.
+    """
+    print(
+        f"OpenAI call failed ({retry_state.outcome.exception()!r}); "
+        f"retry {retry_state.attempt_number}/{OPENAI_MAX_ATTEMPTS - 1} "
+        f"in {retry_state.next_action.sleep:.1f}s",
+        file=sys.stderr,
+    )
+
+
+# Exponential backoff with jitter for transient OpenAI failures. Works on both
+# plain functions and coroutines. Create OpenAI clients with max_retries=0 so
+# the SDK's own retries don't multiply with these.
+openai_retry = retry(
+    wait=wait_random_exponential(multiplier=1, max=OPENAI_MAX_BACKOFF),
+    stop=stop_after_attempt(OPENAI_MAX_ATTEMPTS),
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+    before_sleep=_log_openai_retry,
+    reraise=True,
+)
@@ -1,10 +1,15 @@
 import os
 from typing import List, Any
 
+import tiktoken
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from openai import OpenAI
 
+from api_clients import get_http_client, openai_retry
+from embedding_cache import get_cached_embeddings, cache_embeddings
+from vector_format import format_embedding
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -13,80 +18,181 @@ SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
     raise RuntimeError("Missing Supabase config in .env")
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=get_http_client(), max_retries=0)
+supabase: Client = create_client(
+    SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, options=ClientOptions(httpx_client=get_http_client())
+)
+
+EMBED_MODEL = "text-embedding-3-small"
+
+# Number of texts sent per embeddings request
+EMBED_BATCH_SIZE = 100
+
+# The model accepts 8192 tokens per input; keep a little headroom
+MAX_EMBED_TOKENS = 8000
+# Total tokens allowed across all inputs of one embeddings request
+MAX_REQUEST_TOKENS = 300_000
+
+# Tokenizer used by text-embedding-3-small
+_encoding = tiktoken.get_encoding("cl100k_base")
 
 
-def get_pages_without_embeddings(limit: int = 50) -> List[dict]:
+def get_pages_without_embeddings(limit: int = 50, last_id: str | None = None) -> List[dict]:
     """
-    Fetch diary_pages rows where embedding is null.
+    Fetch diary_pages rows where embedding is null, ordered by id.
+
+    Pass the last id of the previous batch as `last_id` to continue after it
+    (keyset pagination), so rows that were skipped are not fetched again.
     """
     # Supabase Python client: .is_("embedding", "null") won't work; we use raw filter
-    resp = (
+    query = (
         supabase.table("diary_pages")
-        .select("*")
+        .select("id, clean_text, raw_text")
         .filter("embedding", "is", "null")
-        .limit(limit)
-        .execute()
     )
+    if last_id is not None:
+        query = query.gt("id", last_id)
+    resp = query.order("id").limit(limit).execute()
     return resp.data or []
 
 
-def create_embedding(text: str) -> list[float]:
+def truncate_to_tokens(text: str, max_tokens: int = MAX_EMBED_TOKENS) -> tuple[str, int]:
     """
-    Call OpenAI embeddings API for the given text.
+    Cut `text` down to at most `max_tokens` tokens.
+    Returns the (possibly shortened) text and its token count.
     """
-    # Optionally truncate very long text if needed
-    text = text.strip()
-    if not text:
-        return []
+    tokens = _encoding.encode(text, disallowed_special=())
+    if len(tokens) > max_tokens:
+        return _encoding.decode(tokens[:max_tokens]), max_tokens
+    return text, len(tokens)
 
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text,
-    )
-    return response.data[0].embedding
 
-
-def update_page_embedding(page_id: str, embedding: List[float]) -> Any:
+@openai_retry
+def _request_embeddings(inputs: List[str]) -> List[List[float]]:
     """
-    Update a single diary_pages row with the given embedding.
+    One embeddings API call; results are in the same order as `inputs`.
     """
-    resp = (
-        supabase.table("diary_pages")
-        .update({"embedding": embedding})
-        .eq("id", page_id)
-        .execute()
+    response = client.embeddings.create(
+        model=EMBED_MODEL,
+        input=inputs,
     )
-    return resp
+    # The API returns items tagged with the index of their input
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
 
-def main():
-    print("Fetching pages without embeddings...")
-    pages = get_pages_without_embeddings(limit=50)
+def create_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Embed a batch of texts, calling the OpenAI API only for cache misses.
 
-    if not pages:
-        print("No pages found without embeddings. All caught up!")
-        return
+    Returns one embedding per input text, in the same order. Empty texts are
+    not sent to the API and get an empty list back. Long texts are truncated
+    to MAX_EMBED_TOKENS, and misses are split across requests so none goes
+    over MAX_REQUEST_TOKENS.
+    """
+    prepared = []
+    token_counts = []
+    for t in texts:
+        text, n_tokens = truncate_to_tokens(t.strip())
+        prepared.append(text)
+        token_counts.append(n_tokens)
+    embeddings: List[List[float]] = [[] for _ in texts]
+
+    # Remember where each text that needs the API came from so results can be re-aligned
+    indices = []
+    cached = get_cached_embeddings(EMBED_MODEL, prepared)
+    for i, (text, embedding) in enumerate(zip(prepared, cached)):
+        if not text:
+            continue
+        if embedding is not None:
+            embeddings[i] = embedding
+        else:
+            indices.append(i)
+
+    # Pack misses into requests under the per-request token cap
+    groups: List[List[int]] = []
+    group: List[int] = []
+    group_tokens = 0
+    for i in indices:
+        if group and group_tokens + token_counts[i] > MAX_REQUEST_TOKENS:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(i)
+        group_tokens += token_counts[i]
+    if group:
+        groups.append(group)
+
+    for group in groups:
+        misses = [prepared[i] for i in group]
+        for i, embedding in zip(group, _request_embeddings(misses)):
+            embeddings[i] = embedding
+
+        cache_embeddings(EMBED_MODEL, misses, [embeddings[i] for i in group])
+
+    return embeddings
+
+
+def update_page_embeddings(rows: List[dict]) -> Any:
+    """
+    Write embeddings for many diary_pages rows with a single request.
 
-    print(f"Found {len(pages)} pages to embed.")
+    Each row is {"id": ..., "embedding": ...}. The update_embeddings_bulk
+    Postgres function (see README) runs one UPDATE over all of them, so only
+    the embedding column is touched and deleted pages are not re-created.
+    """
+    resp = supabase.rpc("update_embeddings_bulk", {"rows": rows}).execute()
+    return resp
 
+
+def backfill_batch(pages: List[dict]) -> int:
+    """
+    Embed one batch of pages and write the embeddings back.
+    Returns the number of pages updated.
+    """
+    to_embed = []
     for page in pages:
-        page_id = page["id"]
         text = page.get("clean_text") or page.get("raw_text") or ""
-        print(f"\nEmbedding page {page_id[:8]}...")
-
         if not text.strip():
-            print("  Skipping: empty text.")
+            print(f"Skipping page {page['id'][:8]}: empty text.")
             continue
+        to_embed.append((page, text))
+
+    rows = []
+    for start in range(0, len(to_embed), EMBED_BATCH_SIZE):
+        chunk = to_embed[start:start + EMBED_BATCH_SIZE]
+        print(f"\nEmbedding {len(chunk)} pages in one request...")
+        embeddings = create_embeddings([text for _, text in chunk])
+
+        for (page, _), embedding in zip(chunk, embeddings):
+            rows.append({"id": page["id"], "embedding": format_embedding(embedding)})
 
-        embedding = create_embedding(text)
-        print(f"  Embedding length: {len(embedding)}")
+    if rows:
+        update_page_embeddings(rows)
+        print(f"Updated {len(rows)} embeddings in Supabase.")
 
-        update_page_embedding(page_id, embedding)
-        print("  Updated embedding in Supabase.")
+    return len(rows)
+
+
+def main():
+    print("Fetching pages without embeddings...")
+    last_id = None
+    found = 0
+    updated = 0
+
+    while True:
+        pages = get_pages_without_embeddings(limit=50, last_id=last_id)
+        if not pages:
+            break
+
+        found += len(pages)
+        print(f"Found {len(pages)} pages to embed.")
+        updated += backfill_batch(pages)
+        last_id = pages[-1]["id"]
+
+    if not found:
+        print("No pages found without embeddings. All caught up!")
+        return
 
-    print("\nDone backfilling embeddings for this batch.")
+    print(f"\nDone backfilling embeddings: {updated} of {found} pages updated.")
 
 
 if __name__ == "__main__":
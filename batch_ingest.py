@@ -7,8 +7,9 @@ import os
 import sys
 from pathlib import Path
 
-# Import the ingestion function
-from ingest_to_supabase import ingest_text_file
+# Import the ingestion functions
+from ingest_to_supabase import build_payload, insert_pages_chunked
+
 
 def main():
     output_dir = Path("output")
@@ -35,20 +36,19 @@ def main():
     success_count = 0
     error_count = 0
     
+    payloads = []
     for i, txt_file in enumerate(txt_files, 1):
-        print(f"\n[{i}/{len(txt_files)}] Processing: {txt_file.name}")
-        print("-" * 60)
-        
+        print(f"\n[{i}/{len(txt_files)}] Preparing: {txt_file.name}")
         try:
-            # Ingest with automatic date/page inference
-            ingest_text_file(str(txt_file))
-            success_count += 1
-            print(f"✓ Successfully ingested: {txt_file.name}")
+            # Build the row with automatic date/page inference
+            payloads.append(build_payload(str(txt_file)))
         except Exception as e:
             error_count += 1
-            print(f"✗ Error ingesting {txt_file.name}: {e}")
-            # Continue with next file
-            continue
+            print(f"✗ Error reading {txt_file.name}: {e}")
+    
+    inserted, failed = insert_pages_chunked(payloads)
+    success_count += inserted
+    error_count += failed
     
     print("\n" + "="*60)
     print("Batch ingestion complete!")
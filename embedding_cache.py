@@ -0,0 +1,116 @@
+"""
+On-disk cache of OpenAI embeddings, keyed by a hash of (model, text).
+
+Re-running a backfill or re-ingesting unchanged pages then costs a SQLite
+lookup instead of another embeddings API call. Entries are also keyed by a
+hash of the normalized text, so re-OCRed pages that differ only in case,
+whitespace or punctuation reuse the existing embedding.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from typing import List
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embed_cache.db")
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+_conn: sqlite3.Connection | None = None
+# One connection is shared by every thread, so all access goes through this lock
+_lock = threading.Lock()
+
+
+def _get_conn() -> sqlite3.Connection:
+    """
+    Open the cache database on first use and make sure the table exists.
+    Call with _lock held.
+    """
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(EMBED_CACHE_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(hash BLOB PRIMARY KEY, vec BLOB NOT NULL, norm_hash BLOB)"
+        )
+        # Caches created before norm_hash existed need the column added
+        columns = [row[1] for row in _conn.execute("PRAGMA table_info(embeddings)")]
+        if "norm_hash" not in columns:
+            _conn.execute("ALTER TABLE embeddings ADD COLUMN norm_hash BLOB")
+        _conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_norm_hash_idx ON embeddings (norm_hash)"
+        )
+    return _conn
+
+
+def text_hash(model: str, text: str) -> bytes:
+    """
+    Cache key for `text` embedded with `model`.
+    """
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase, drop punctuation and collapse whitespace.
+    """
+    text = _PUNCT_RE.sub("", text.lower())
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def norm_text_hash(model: str, text: str) -> bytes:
+    """
+    Second-level cache key: hash of the normalized text.
+    """
+    return text_hash(model, normalize_text(text))
+
+
+def get_cached_embeddings(model: str, texts: List[str]) -> List[List[float] | None]:
+    """
+    Look up embeddings for `texts`. Returns one entry per text, None on a miss.
+
+    Tries the exact text first, then falls back to the normalized text.
+    """
+    results: List[List[float] | None] = []
+    with _lock:
+        conn = _get_conn()
+        for text in texts:
+            row = conn.execute(
+                "SELECT vec FROM embeddings WHERE hash = ?", (text_hash(model, text),)
+            ).fetchone()
+            if row is None:
+                row = conn.execute(
+                    "SELECT vec FROM embeddings WHERE norm_hash = ? LIMIT 1",
+                    (norm_text_hash(model, text),),
+                ).fetchone()
+            if row is None:
+                results.append(None)
+            else:
+                vec = array("f")
+                vec.frombytes(row[0])
+                results.append(vec.tolist())
+    return results
+
+
+def cache_embeddings(model: str, texts: List[str], embeddings: List[List[float]]) -> None:
+    """
+    Store embeddings for `texts` (stored as float32) in one transaction.
+    """
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (hash, vec, norm_hash) VALUES (?, ?, ?)",
+                [
+                    (
+                        text_hash(model, text),
+                        array("f", embedding).tobytes(),
+                        norm_text_hash(model, text),
+                    )
+                    for text, embedding in zip(texts, embeddings)
+                ],
+            )
@@ -1,10 +1,14 @@
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime
+from itertools import islice
 
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+
+from api_clients import get_http_client
 
 load_dotenv()
 
@@ -19,7 +23,33 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
 if not USER_ID or not MAIN_DIARY_ID:
     raise RuntimeError("Missing PROJECTAJ_USER_ID or PROJECTAJ_MAIN_DIARY_ID in .env")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+supabase: Client = create_client(
+    SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, options=ClientOptions(httpx_client=get_http_client())
+)
+
+# Rows per insert request, to stay under PostgREST payload limits
+INSERT_CHUNK_SIZE = 500
+
+# Insert requests in flight at once
+INSERT_WORKERS = 4
+
+# Dates near the top of a page: ISO (YYYY-MM-DD) and month-name, e.g.
+# "Jan 1st, 2024" or "January 1, 2024". Kept as separate patterns so a
+# month-name match can't swallow the year of an adjacent ISO date.
+_ISO_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+_MONTH_RE = re.compile(
+    r"\b("
+    r"Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|"
+    r"Jul(?:y)?|Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|"
+    r"Nov(?:ember)?|Dec(?:ember)?)\s+(\d{1,2})(?:st|nd|rd|th)?\s*,\s*(\d{4})",
+    re.IGNORECASE,
+)
+
+# Lines are pulled lazily so only the head of a long OCR file is scanned
+_LINE_RE = re.compile(r"[^\r\n]+")
+
+# Page markers written by ocr.py, e.g. "=== PAGE 1 ==="
+_PAGE_RE = re.compile(r"^===\s*PAGE\s+(\d+)\s*===\s*$", re.IGNORECASE)
 
 
 def infer_entry_date(text: str) -> date | None:
@@ -32,47 +62,40 @@ def infer_entry_date(text: str) -> date | None:
       * Month-name dates: e.g. "Jan 1st, 2024", "January 1, 2024"
     - Return a `date` if something parses, otherwise None.
     """
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    lines = lines[:10]  # only inspect first few lines
+    # Only inspect the first few non-empty lines
+    lines = islice(
+        (ln for ln in (m.group().strip() for m in _LINE_RE.finditer(text)) if ln), 10
+    )
 
-    # 1) ISO format: YYYY-MM-DD
-    iso_re = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+    # ISO dates win over month-name dates anywhere in those lines, so keep
+    # the first month-name date and return it only if no ISO date turns up
+    month_date = None
     for line in lines:
-        m = iso_re.search(line)
+        m = _ISO_RE.search(line)
         if m:
             try:
                 return date.fromisoformat(m.group(1))
             except ValueError:
                 pass
+        if month_date is None:
+            m = _MONTH_RE.search(line)
+            if m:
+                month_date = _parse_month_date(*m.groups())
+
+    return month_date
 
-    # 2) Month-name formats, e.g. "Jan 1st, 2024" or "January 1, 2024"
-    month_re = re.compile(
-        r"\b("
-        r"Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|"
-        r"Jul(?:y)?|Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|"
-        r"Nov(?:ember)?|Dec(?:ember)?)\s+(\d{1,2})(?:st|nd|rd|th)?\s*,\s*(\d{4})",
-        re.IGNORECASE,
-    )
-    for line in lines:
-        m = month_re.search(line)
-        if m:
-            month_str, day_str, year_str = m.groups()
-            # Normalize e.g. "jan" -> "Jan"
-            month_norm = month_str[:1].upper() + month_str[1:].lower()
-            try:
-                dt = datetime.strptime(
-                    f"{month_norm} {int(day_str)}, {year_str}", "%b %d, %Y"
-                )
-                return dt.date()
-            except ValueError:
-                try:
-                    dt = datetime.strptime(
-                        f"{month_norm} {int(day_str)}, {year_str}", "%B %d, %Y"
-                    )
-                    return dt.date()
-                except ValueError:
-                    continue
 
+def _parse_month_date(month_str: str, day_str: str, year_str: str) -> date | None:
+    """
+    Parse a month-name date such as ("Jan", "1", "2024") or ("January", "1", "2024").
+    """
+    # Normalize e.g. "jan" -> "Jan"
+    month_norm = month_str[:1].upper() + month_str[1:].lower()
+    for fmt in ("%b %d, %Y", "%B %d, %Y"):
+        try:
+            return datetime.strptime(f"{month_norm} {int(day_str)}, {year_str}", fmt).date()
+        except ValueError:
+            continue
     return None
 
 
@@ -85,7 +108,7 @@ def infer_page_number(text: str) -> int | None:
     at the top of each page.
     """
     for line in text.splitlines():
-        m = re.match(r"^===\s*PAGE\s+(\d+)\s*===\s*$", line.strip(), re.IGNORECASE)
+        m = _PAGE_RE.match(line.strip())
         if m:
             try:
                 return int(m.group(1))
@@ -94,9 +117,14 @@ def infer_page_number(text: str) -> int | None:
     return None
 
 
-def ingest_text_file(txt_path: str, entry_date: date | None = None, page_number: int | None = None):
+def build_text_payload(
+    raw_text: str,
+    source_file_name: str,
+    entry_date: date | None = None,
+    page_number: int | None = None,
+) -> dict:
     """
-    Ingest a single OCR output text file into Supabase.
+    Build the diary_pages row for OCR text that is already in memory.
 
     - If `entry_date` is not provided, we try to infer it from the text.
     - If `page_number` is not provided, we try to infer it from the text
@@ -104,10 +132,6 @@ def ingest_text_file(txt_path: str, entry_date: date | None = None, page_number:
     - Both fields are optional so this works for non-diary content too
       (recipes, notes, exams, etc.).
     """
-    # Read the file
-    with open(txt_path, "r", encoding="utf-8") as f:
-        raw_text = f.read()
-
     # Infer entry_date if not provided
     if entry_date is None:
         inferred_date = infer_entry_date(raw_text)
@@ -129,8 +153,6 @@ def ingest_text_file(txt_path: str, entry_date: date | None = None, page_number:
     # For now, we'll just set clean_text = raw_text
     clean_text = raw_text
 
-    source_file_name = os.path.basename(txt_path)
-
     payload = {
         "user_id": USER_ID,
         "diary_id": MAIN_DIARY_ID,
@@ -141,13 +163,93 @@ def ingest_text_file(txt_path: str, entry_date: date | None = None, page_number:
         "clean_text": clean_text,
         "entry_date": entry_date.isoformat() if entry_date else None,
     }
+    return payload
+
+
+def build_payload(txt_path: str, entry_date: date | None = None, page_number: int | None = None) -> dict:
+    """
+    Build the diary_pages row for a single OCR output text file.
+    """
+    # Read the file
+    with open(txt_path, "r", encoding="utf-8") as f:
+        raw_text = f.read()
+
+    return build_text_payload(
+        raw_text, os.path.basename(txt_path), entry_date=entry_date, page_number=page_number
+    )
+
+
+def insert_pages(payloads: list[dict]):
+    """
+    Insert many diary_pages rows with a single request (one transaction).
+    """
+    return supabase.table("diary_pages").insert(payloads).execute()
+
+
+def insert_pages_chunked(payloads: list[dict]) -> tuple[int, int]:
+    """
+    Insert diary_pages rows in INSERT_CHUNK_SIZE chunks, a few requests at a time.
+
+    Returns (rows inserted, rows that failed). Each chunk is one transaction,
+    so a failed request fails its whole chunk.
+    """
+    chunks = [
+        payloads[start:start + INSERT_CHUNK_SIZE]
+        for start in range(0, len(payloads), INSERT_CHUNK_SIZE)
+    ]
+    print(f"\nInserting {len(payloads)} rows in {len(chunks)} request(s)...")
+
+    success_count = 0
+    error_count = 0
+    with ThreadPoolExecutor(max_workers=INSERT_WORKERS) as executor:
+        futures = {executor.submit(insert_pages, chunk): chunk for chunk in chunks}
+
+        for future in as_completed(futures):
+            chunk = futures[future]
+            first, last = chunk[0]["source_file_name"], chunk[-1]["source_file_name"]
+            try:
+                future.result()
+                success_count += len(chunk)
+                print(f"✓ Successfully ingested {len(chunk)} files ({first} .. {last})")
+            except Exception as e:
+                error_count += len(chunk)
+                print(f"✗ Error ingesting {len(chunk)} files ({first} .. {last}): {e}")
+
+    return success_count, error_count
+
+
+def ingest_text(
+    raw_text: str,
+    source_file_name: str,
+    entry_date: date | None = None,
+    page_number: int | None = None,
+):
+    """
+    Ingest OCR text that is already in memory into Supabase.
+
+    See build_text_payload for how `entry_date` and `page_number` are filled in.
+    """
+    payload = build_text_payload(
+        raw_text, source_file_name, entry_date=entry_date, page_number=page_number
+    )
 
     print("Inserting row into diary_pages...")
-    res = supabase.table("diary_pages").insert(payload).execute()
+    res = insert_pages([payload])
 
     print("Insert result:", res)
 
 
+def ingest_text_file(txt_path: str, entry_date: date | None = None, page_number: int | None = None):
+    """
+    Ingest a single OCR output text file into Supabase.
+    """
+    # Read the file
+    with open(txt_path, "r", encoding="utf-8") as f:
+        raw_text = f.read()
+
+    ingest_text(raw_text, os.path.basename(txt_path), entry_date=entry_date, page_number=page_number)
+
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python ingest_to_supabase.py path/to/output.txt [YYYY-MM-DD] [page_number]")
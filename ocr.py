@@ -2,11 +2,17 @@ import os
 import sys
 import io
 import base64
-from typing import List
+import asyncio
+import hashlib
+import math
+from contextlib import closing
+from typing import Iterator
 
 from dotenv import load_dotenv
 from PIL import Image
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+from api_clients import make_async_http_client, openai_retry
 
 try:
     import fitz  # PyMuPDF
@@ -28,13 +34,62 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise RuntimeError("OPENAI_API_KEY not set in .env")
 
-client = OpenAI(api_key=api_key)
+OCR_MODEL = "gpt-4.1-mini"
+
+# Instructions sent with every page image; part of the OCR cache key
+OCR_PROMPT = (
+    "This is a scanned handwritten diary page.\n\n"
+    "Transcribe the handwriting as accurately as possible into plain text. "
+    "Preserve the original wording and approximate line breaks.\n\n"
+    "If any word or phrase is unclear or illegible, DO NOT guess. "
+    'Instead, insert the token "<illegible>" in place of that word or phrase.\n\n'
+    "Do not add commentary, explanations, or summaries. "
+    "Only output the transcribed diary content."
+)
+
+# Maximum number of pages sent to the vision API at the same time
+OCR_CONCURRENCY = 8
+
+# Finished transcriptions are cached here, keyed by a hash of the input file
+OCR_CACHE_DIR = ".cache_ocr"
+# Bump when page rendering changes in a way the cache key doesn't cover
+# (e.g. the grayscale conversion) so older transcriptions are not reused
+OCR_CACHE_VERSION = "1"
+
+# Resolution PDF pages are rendered at (before the MAX_IMAGE_EDGE cap)
+PDF_DPI = 300
+
+# Page images are scaled so their long edge is at most this many pixels;
+# the vision model reads handwriting just as well at this size
+MAX_IMAGE_EDGE = 1600
+
+# JPEG quality used when encoding page images for upload
+JPEG_QUALITY = 80
+
+_JPEG_DATA_URI_PREFIX = b"data:image/jpeg;base64,"
+
+def _render_pdf_page(doc, page_num: int, dpi: int) -> bytes:
+    """
+    Render one page of an open PDF to grayscale JPEG bytes.
+    """
+    page = doc[page_num]
+    # Zoom factor for desired DPI (default PDF DPI is 72), capped
+    # so the rendered long edge stays within MAX_IMAGE_EDGE
+    zoom = min(dpi / 72.0, MAX_IMAGE_EDGE / max(page.rect.width, page.rect.height))
+    mat = fitz.Matrix(zoom, zoom)
+    # Render straight to grayscale (1 byte/pixel); handwriting
+    # reads just as well, and MuPDF encodes the JPEG directly
+    pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY, alpha=False)
+    return pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
 
 
-def file_to_images(file_path: str, dpi: int = 300) -> List[Image.Image]:
+def iter_page_jpegs(file_path: str, dpi: int = PDF_DPI) -> Iterator[bytes | memoryview]:
     """
-    Convert a PDF or image file into a list of PIL Images.
+    Yield the pages of a PDF or image file as JPEG bytes, one at a time.
     Supports PDF, HEIC, JPEG, PNG, and other image formats.
+
+    Pages are rendered lazily so only the pages currently being worked on
+    are held in memory.
     """
     ext = os.path.splitext(file_path)[1].lower()
     
@@ -43,32 +98,26 @@ def file_to_images(file_path: str, dpi: int = 300) -> List[Image.Image]:
         if not HAS_PYMUPDF:
             raise RuntimeError("PyMuPDF (fitz) is required for PDF files. Install it with: pip install PyMuPDF")
         
-        doc = fitz.open(file_path)
-        images = []
-        
-        # Calculate zoom factor for desired DPI (default PDF DPI is 72)
-        zoom = dpi / 72.0
-        mat = fitz.Matrix(zoom, zoom)
-        
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            # Render page to pixmap
-            pix = page.get_pixmap(matrix=mat)
-            # Convert to PIL Image
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            images.append(img)
-        
-        doc.close()
-        return images
+        # Pages are capped at MAX_IMAGE_EDGE, so each renders in a few ms,
+        # well behind the vision calls; a serial render keeps up
+        with closing(fitz.open(file_path)) as doc:
+            for page_num in range(len(doc)):
+                yield _render_pdf_page(doc, page_num, dpi)
     
     # Handle image files (HEIC, JPEG, PNG, etc.)
     else:
         try:
             img = Image.open(file_path)
-            # Convert to RGB if necessary (HEIC might be in other modes)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            return [img]
+            # MPO (multi-picture JPEG, e.g. iPhone photos) uses the same decoder
+            if img.format in ("JPEG", "MPO") and max(img.size) > MAX_IMAGE_EDGE:
+                # Let libjpeg decode straight to grayscale at a reduced scale
+                # (no smaller than the size we upload) instead of decoding
+                # the full-resolution color image and shrinking it later
+                ratio = MAX_IMAGE_EDGE / max(img.size)
+                img.draft("L", (math.ceil(img.width * ratio), math.ceil(img.height * ratio)))
+            # Convert to grayscale; the JPEG encoder takes mode "L" directly
+            if img.mode != 'L':
+                img = img.convert('L')
         except Exception as e:
             if ext in ['.heic', '.heif'] and not HAS_HEIF:
                 raise RuntimeError(
@@ -76,43 +125,47 @@ def file_to_images(file_path: str, dpi: int = 300) -> List[Image.Image]:
                     f"Install it with: pip install pillow-heif"
                 ) from e
             raise RuntimeError(f"Failed to open image file: {e}") from e
+        yield pil_image_to_jpeg(img)
 
 
-def pil_image_to_data_uri(img: Image.Image, fmt: str = "JPEG") -> str:
+def pil_image_to_jpeg(img: Image.Image) -> memoryview:
     """
-    Convert a PIL image to a base64 data URI that OpenAI's vision models can read.
+    Encode a PIL image as JPEG bytes, downscaled to fit MAX_IMAGE_EDGE.
     """
+    if max(img.size) > MAX_IMAGE_EDGE:
+        # thumbnail() resizes in place and keeps the aspect ratio
+        img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+
     buffer = io.BytesIO()
-    img.save(buffer, format=fmt)
-    b64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    img.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=False, subsampling=2)
+    # getbuffer() exposes the encoded bytes without copying them out of the BytesIO
+    return buffer.getbuffer()
 
-    mime = "image/jpeg" if fmt.upper() == "JPEG" else "image/png"
-    return f"data:{mime};base64,{b64}"
 
+def jpeg_to_data_uri(jpeg_bytes: bytes | memoryview) -> str:
+    """
+    Convert JPEG bytes to a base64 data URI that OpenAI's vision models can read.
+    """
+    # Build the URI as bytes and decode once; base64 output is pure ASCII
+    return (_JPEG_DATA_URI_PREFIX + base64.b64encode(jpeg_bytes)).decode("ascii")
 
-def ocr_page_with_openai(img: Image.Image) -> str:
+
+@openai_retry
+async def ocr_page_with_openai(aclient: AsyncOpenAI, jpeg_bytes: bytes | memoryview) -> str:
     """
     Send a single page image to OpenAI's vision model and return the extracted text.
     """
-    image_data_uri = pil_image_to_data_uri(img, fmt="JPEG")
+    image_data_uri = jpeg_to_data_uri(jpeg_bytes)
 
-    response = client.responses.create(
-        model="gpt-4.1-mini",
+    response = await aclient.responses.create(
+        model=OCR_MODEL,
         input=[
             {
                 "role": "user",
                 "content": [
                     {
                         "type": "input_text",
-                        "text": (
-                            "This is a scanned handwritten diary page.\n\n" +
-              "Transcribe the handwriting as accurately as possible into plain text. " +
-              "Preserve the original wording and approximate line breaks.\n\n" +
-              "If any word or phrase is unclear or illegible, DO NOT guess. " +
-              'Instead, insert the token "<illegible>" in place of that word or phrase.\n\n' +
-              "Do not add commentary, explanations, or summaries. " +
-              "Only output the transcribed diary content."
-                        ),
+                        "text": OCR_PROMPT,
                     },
                     {
                         "type": "input_image",
@@ -134,19 +187,82 @@ def ocr_page_with_openai(img: Image.Image) -> str:
         return first_content.text
 
 
-def ocr_file_with_openai(file_path: str) -> str:
+def ocr_cache_path(file_path: str) -> str:
     """
-    Convert a PDF or image file to text using OpenAI vision, one page at a time.
+    Location of the cached transcription for `file_path`.
+
+    The key covers the file contents plus every setting that affects the
+    output, so changing any of them invalidates old entries.
+    """
+    h = hashlib.sha256(
+        f"{OCR_CACHE_VERSION}|{OCR_MODEL}|{PDF_DPI}|{MAX_IMAGE_EDGE}|{JPEG_QUALITY}|"
+        f"{OCR_PROMPT}\0".encode("utf-8")
+    )
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return os.path.join(OCR_CACHE_DIR, f"{h.hexdigest()}.txt")
+
+
+async def ocr_file_with_openai_async(file_path: str, concurrency: int = OCR_CONCURRENCY) -> str:
     """
-    images = file_to_images(file_path)
-    all_text = []
+    Convert a PDF or image file to text using OpenAI vision.
 
-    for i, img in enumerate(images):
-        print(f"Processing page {i + 1}/{len(images)} with OpenAI Vision...")
-        page_text = ocr_page_with_openai(img)
-        all_text.append(f"=== PAGE {i + 1} ===\n{page_text.strip()}\n")
+    `concurrency` workers each pull the next rendered page and send it to the
+    API, so rendering overlaps with in-flight requests and at most
+    `concurrency` pages are in memory. Pages are reassembled in page order.
 
-    return "\n\n".join(all_text)
+    Results are cached in OCR_CACHE_DIR, so re-running on an unchanged file
+    makes no API calls.
+    """
+    cache_path = ocr_cache_path(file_path)
+    if os.path.exists(cache_path):
+        print(f"Using cached OCR result: {cache_path}")
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    loop = asyncio.get_running_loop()
+    pages = enumerate(iter_page_jpegs(file_path))
+    # The page generator is not thread-safe; render one page at a time
+    render_lock = asyncio.Lock()
+    results: dict[int, str] = {}
+
+    async with AsyncOpenAI(api_key=api_key, http_client=make_async_http_client(), max_retries=0) as aclient:
+        async def worker() -> None:
+            while True:
+                async with render_lock:
+                    item = await loop.run_in_executor(None, next, pages, None)
+                if item is None:
+                    return
+                i, jpeg_bytes = item
+                print(f"Processing page {i + 1} with OpenAI Vision...")
+                page_text = await ocr_page_with_openai(aclient, jpeg_bytes)
+                results[i] = f"=== PAGE {i + 1} ===\n{page_text.strip()}\n"
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    text = "\n\n".join(results[i] for i in sorted(results))
+
+    # Write to a temp file and rename, so a crash never leaves a partial entry
+    os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, cache_path)
+
+    return text
+
+
+def ocr_file_with_openai(file_path: str) -> str:
+    """
+    Synchronous entry point for ocr_file_with_openai_async.
+    """
+    return asyncio.run(ocr_file_with_openai_async(file_path))
 
 
 def main():
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+OCR input files, ingest the text into Supabase and backfill embeddings,
+all in one process.
+
+Unlike ocr.py + batch_ingest.py, the OCR text is handed straight to the
+ingestion step instead of being written to output/ and read back.
+"""
+import sys
+from pathlib import Path
+
+from ocr import ocr_file_with_openai
+from ingest_to_supabase import build_text_payload, insert_pages_chunked
+
+
+def main():
+    if len(sys.argv) >= 2:
+        input_paths = [Path(p) for p in sys.argv[1:]]
+    else:
+        input_dir = Path("input")
+        if not input_dir.exists():
+            print(f"Error: {input_dir} directory not found.")
+            sys.exit(1)
+        input_paths = sorted(p for p in input_dir.iterdir() if p.is_file() and not p.name.startswith("."))
+
+    if not input_paths:
+        print("No input files found.")
+        sys.exit(0)
+
+    print(f"Found {len(input_paths)} files to process.")
+
+    payloads = []
+    error_count = 0
+
+    for i, input_path in enumerate(input_paths, 1):
+        print(f"\n[{i}/{len(input_paths)}] OCR: {input_path.name}")
+        print("-" * 60)
+
+        try:
+            text = ocr_file_with_openai(str(input_path))
+            payloads.append(build_text_payload(text, input_path.name))
+        except Exception as e:
+            error_count += 1
+            print(f"✗ Error processing {input_path.name}: {e}")
+
+    success_count, failed = insert_pages_chunked(payloads)
+    error_count += failed
+
+    print("\n" + "="*60)
+    print("Pipeline ingestion complete!")
+    print(f"  Success: {success_count}")
+    print(f"  Errors: {error_count}")
+    print("="*60)
+
+    if success_count > 0:
+        print("\nBackfilling embeddings...")
+        print("="*60 + "\n")
+
+        from backfill_embeddings import main as backfill_main
+        backfill_main()
+
+    print("\n✓ All done!")
+
+
+if __name__ == "__main__":
+    main()
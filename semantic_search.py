@@ -1,11 +1,16 @@
+import asyncio
+import io
 import os
 import sys
 from typing import List
 
 from dotenv import load_dotenv
-from supabase import create_client, Client
 from openai import OpenAI
 
+from api_clients import get_http_client, make_async_http_client, openai_retry
+from embedding_cache import get_cached_embeddings, cache_embeddings
+from vector_format import format_embedding
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -13,37 +18,114 @@ SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
 if not SUPABASE_URL or not SUPABASE_ANON_KEY:
     raise RuntimeError("Missing SUPABASE_URL or SUPABASE_ANON_KEY in .env")
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=get_http_client(), max_retries=0)
 
+# The match RPC is called straight through PostgREST: on the shared
+# keep-alive client for one search, or an async client for several at once
+MATCH_RPC_URL = f"{SUPABASE_URL}/rest/v1/rpc/match_diary_pages"
+SUPABASE_HEADERS = {
+    "apikey": SUPABASE_ANON_KEY,
+    "Authorization": f"Bearer {SUPABASE_ANON_KEY}",
+}
 
-def create_query_embedding(query: str) -> List[float]:
+
+EMBED_MODEL = "text-embedding-3-small"
+
+
+@openai_retry
+def _request_embeddings(inputs: List[str]) -> List[List[float]]:
+    """
+    One embeddings API call; results are in the same order as `inputs`.
+    """
     response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=query,
+        model=EMBED_MODEL,
+        input=inputs,
     )
-    return response.data[0].embedding
+    # The API returns items tagged with the index of their input
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def create_query_embeddings(queries: List[str]) -> List[List[float]]:
+    """
+    Embed several queries, answering repeats from the on-disk cache and
+    sending the rest to OpenAI in a single request.
+    """
+    embeddings = get_cached_embeddings(EMBED_MODEL, queries)
+    misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    if misses:
+        miss_queries = [queries[i] for i in misses]
+        new_embeddings = _request_embeddings(miss_queries)
+        for i, embedding in zip(misses, new_embeddings):
+            embeddings[i] = embedding
+        cache_embeddings(EMBED_MODEL, miss_queries, new_embeddings)
+
+    return embeddings
+
+
+def create_query_embedding(query: str) -> List[float]:
+    return create_query_embeddings([query])[0]
+
+
+def _match_params(embedding: List[float], match_count: int) -> dict:
+    """
+    Arguments for the match_diary_pages Postgres function.
+    """
+    return {
+        "query_embedding": format_embedding(embedding),
+        "match_count": match_count,
+    }
+
+
+async def semantic_search_many(queries: List[str], match_count: int = 5) -> List[list[dict]]:
+    """
+    Run several searches at once; returns one result list per query.
+
+    Embeddings for all queries come from one (cached) batch request, then
+    the match_diary_pages calls run concurrently.
+    """
+    # One batched (blocking) embeddings call, kept off the event loop
+    embeddings = await asyncio.to_thread(create_query_embeddings, queries)
+
+    async with make_async_http_client() as http:
+        # Call the Postgres function we created
+        responses = await asyncio.gather(*(
+            http.post(
+                MATCH_RPC_URL,
+                headers=SUPABASE_HEADERS,
+                json=_match_params(embedding, match_count),
+            )
+            for embedding in embeddings
+        ))
+
+    results = []
+    for resp in responses:
+        resp.raise_for_status()
+        results.append(resp.json() or [])
+    return results
 
 
 def semantic_search(query: str, match_count: int = 5):
     embedding = create_query_embedding(query)
 
     # Call the Postgres function we created
-    resp = supabase.rpc(
-        "match_diary_pages",
-        {
-            "query_embedding": embedding,
-            "match_count": match_count,
-        },
-    ).execute()
-
-    return resp.data or []
+    resp = get_http_client().post(
+        MATCH_RPC_URL,
+        headers=SUPABASE_HEADERS,
+        json=_match_params(embedding, match_count),
+    )
+    resp.raise_for_status()
+    return resp.json() or []
 
 
 def pretty_print_results(query: str, results: list[dict]):
-    print(f"\nQuery: {query}\n")
+    # Build the whole report in memory and write it once, instead of a
+    # print() (and a write syscall when piped) per line
+    buf = io.StringIO()
+    buf.write(f"\nQuery: {query}\n\n")
     if not results:
-        print("No results found.")
+        buf.write("No results found.\n")
+        sys.stdout.write(buf.getvalue())
         return
 
     for i, row in enumerate(results, start=1):
@@ -55,12 +137,16 @@ def pretty_print_results(query: str, results: list[dict]):
         if len(snippet) > 300:
             snippet = snippet[:300] + "..."
 
-        print(f"Result {i}:")
-        print(f"  Similarity: {similarity:.3f}")
-        print(f"  Date: {entry_date} | Page: {page_number}")
-        print("  Snippet:")
-        print(f"    {snippet}")
-        print("-" * 60)
+        buf.write(
+            f"Result {i}:\n"
+            f"  Similarity: {similarity:.3f}\n"
+            f"  Date: {entry_date} | Page: {page_number}\n"
+            "  Snippet:\n"
+            f"    {snippet}\n"
+            f"{'-' * 60}\n"
+        )
+
+    sys.stdout.write(buf.getvalue())
 
 
 def main():
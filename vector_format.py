@@ -0,0 +1,37 @@
+"""
+Serialize embeddings for pgvector columns and function arguments.
+
+diary_pages.embedding is a halfvec(1536) (fp16), so sending full float64
+reprs over JSON only wastes bandwidth: 5 significant digits are enough to
+pick the same fp16 value on the server. Set PGVECTOR_DTYPE=vector in .env
+for a database that still uses vector(1536).
+"""
+import os
+import struct
+from typing import List
+
+PGVECTOR_DTYPE = os.getenv("PGVECTOR_DTYPE", "halfvec")
+if PGVECTOR_DTYPE not in ("halfvec", "vector"):
+    raise RuntimeError("PGVECTOR_DTYPE must be 'halfvec' or 'vector'")
+
+# Significant digits needed to round-trip an IEEE fp16 value
+HALFVEC_DIGITS = 5
+
+
+def to_halfvec_literal(embedding: List[float]) -> str:
+    """
+    Format an embedding as a compact pgvector literal, e.g. "[0.012344,-0.5]".
+    """
+    # Round to fp16 first so the shortened decimal maps back to the same value
+    halves = struct.unpack(f"{len(embedding)}e", struct.pack(f"{len(embedding)}e", *embedding))
+    return "[" + ",".join(format(x, f".{HALFVEC_DIGITS}g") for x in halves) + "]"
+
+
+def format_embedding(embedding: List[float]) -> str | List[float]:
+    """
+    Serialize an embedding for the configured PGVECTOR_DTYPE: a compact
+    halfvec literal, or the plain float list for vector columns.
+    """
+    if PGVECTOR_DTYPE == "halfvec":
+        return to_halfvec_literal(embedding)
+    return embedding